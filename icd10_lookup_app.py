@@ -1,11 +1,20 @@
+import hashlib
 import io
+import json
+import os
+import re
+import sqlite3
 import textwrap
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from html import escape
 
+import numpy as np
 import pandas as pd
-import requests
+import pyarrow as pa
+import pyarrow.compute as pc
 import streamlit as st
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
 
 # ==========================================
 # PAGE CONFIG
@@ -27,8 +36,23 @@ st.session_state["dark_mode"] = dark_mode
 # ==========================================
 # LIGHT + DARK CSS
 # ==========================================
-LIGHT_CSS = """
-<style>
+# Layout shared by both themes; THEMES only carries the colors.
+BASE_CSS = """
+.hanvion-header {
+    color: white;
+    padding: 26px 30px;
+    border-radius: 18px;
+    margin-bottom: 20px;
+}
+.code-card {
+    padding: 16px 18px;
+    border-radius: 14px;
+    margin-top: 6px;
+}
+"""
+
+THEMES = {
+    "light": """
 html, body, [class*="css"] {
     font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif;
 }
@@ -37,83 +61,192 @@ html, body, [class*="css"] {
 }
 .hanvion-header {
     background: linear-gradient(90deg, #004c97, #0077b6);
-    color: white;
-    padding: 26px 30px;
-    border-radius: 18px;
-    margin-bottom: 20px;
     box-shadow: 0 14px 28px rgba(0,0,0,0.25);
 }
 .code-card {
     background: white;
     border: 1px solid #e2e8f0;
-    padding: 16px 18px;
-    border-radius: 14px;
-    margin-top: 6px;
 }
-</style>
-"""
-
-DARK_CSS = """
-<style>
+""",
+    "dark": """
 [data-testid="stAppViewContainer"] {
     background: #020617;
     color: #e5e7eb;
 }
 .hanvion-header {
     background: radial-gradient(circle at top left, #38bdf8, #1e293b);
-    color: white;
-    padding: 26px 30px;
-    border-radius: 18px;
-    margin-bottom: 20px;
     box-shadow: 0 18px 45px rgba(0,0,0,0.6);
 }
 .code-card {
     background: #0f172a;
     border: 1px solid #1e293b;
-    padding: 16px 18px;
-    border-radius: 14px;
-    margin-top: 6px;
 }
-</style>
-"""
+""",
+}
 
-st.markdown(DARK_CSS if dark_mode else LIGHT_CSS, unsafe_allow_html=True)
+st.markdown(
+    f"<style>{BASE_CSS}{THEMES['dark' if dark_mode else 'light']}</style>",
+    unsafe_allow_html=True,
+)
 
 # ==========================================
 # LOAD CMS ICD-10 FILE (ONLY CMS — NO WHO)
 # ==========================================
-@st.cache_data
-def load_cms_icd10():
-    df = pd.read_excel("section111validicd10-jan2026_cms-updates-to-cms-gov.xlsx")
-    df.columns = df.columns.str.lower().str.strip()
+CMS_XLSX = "section111validicd10-jan2026_cms-updates-to-cms-gov.xlsx"
+CMS_PARQUET = os.path.splitext(CMS_XLSX)[0] + ".parquet"
+CMS_COLUMNS = {
+    "CODE": "code",
+    "SHORT DESCRIPTION (VALID ICD-10 FY2025)": "short_desc",
+    "LONG DESCRIPTION (VALID ICD-10 FY2025)": "long_desc",
+    "NF EXCL": "nf_excl",
+}
 
-    df = df.rename(columns={
-        "code": "code",
-        "short description (valid icd-10 fy2025)": "short_desc",
-        "long description (valid icd-10 fy2025)": "long_desc"
+def read_cms_source():
+    # Parsing the XLSX takes seconds, so keep a Parquet copy next to it and
+    # reuse that until the workbook changes.
+    if (
+        os.path.exists(CMS_PARQUET)
+        and os.path.getmtime(CMS_PARQUET) >= os.path.getmtime(CMS_XLSX)
+    ):
+        return pd.read_parquet(CMS_PARQUET)
+
+    # Only parse the four columns we use
+    df = pd.read_excel(
+        CMS_XLSX,
+        dtype=str,
+        engine="calamine",
+        usecols=lambda c: c.strip().upper() in CMS_COLUMNS,
+    ).fillna("")
+    df.columns = df.columns.str.strip().str.upper()
+    df = df.rename(columns=CMS_COLUMNS)
+
+    if "nf_excl" not in df.columns:
+        df["nf_excl"] = ""
+
+    df = df[["code", "short_desc", "long_desc", "nf_excl"]].astype({
+        "code": "string[pyarrow]",
+        "short_desc": "string[pyarrow]",
+        "long_desc": "string[pyarrow]",
+        "nf_excl": "category",  # a handful of flag values
     })
 
-    df["nf_excl"] = df["nf excl"] if "nf excl" in df.columns else ""
-
-    return df[["code", "short_desc", "long_desc", "nf_excl"]].sort_values("code")
+    try:
+        tmp = f"{CMS_PARQUET}.tmp"
+        df.to_parquet(tmp, compression="zstd", index=False)
+        os.replace(tmp, CMS_PARQUET)
+    except OSError:
+        pass  # read-only checkout: just parse the XLSX next time too
+
+    return df
+
+# The frame and the lookups built from it are shared by every session
+# (cache_resource: no pickle round-trip per rerun). Treat them as read-only —
+# take a df.copy(deep=False) at the call site before adding columns.
+@st.cache_resource
+def load_cms_icd10():
+    df = read_cms_source().sort_values("code")
+
+    # HTML-escaped descriptions for the result cards (escaped once, not per rerun)
+    for col in ("short_desc", "long_desc"):
+        df[f"{col}_html"] = df[col].map(escape)
+
+    return df
+
+@st.cache_resource
+def load_code_index():
+    # code -> row position, for O(1) exact-code lookups
+    return {c: i for i, c in enumerate(load_cms_icd10()["code"].tolist())}
+
+@st.cache_resource
+def load_code_keys():
+    # The frame is sorted by code, so any code prefix is one contiguous range
+    return load_cms_icd10()["code"].to_numpy(dtype=object)
+
+@st.cache_resource
+def load_search_arrays():
+    # Lower-cased Arrow arrays for the search, built once per process so each
+    # query calls the compute kernels directly. They live only here, not as
+    # extra columns on the cached frame.
+    df = load_cms_icd10()
+    code, short_desc, long_desc = (pa.array(df[c]) for c in ("code", "short_desc", "long_desc"))
+    return {
+        "code_lc": pc.utf8_lower(code),
+        "short_desc_lc": pc.utf8_lower(short_desc),
+        # One search string per row, so a query is a single scan.
+        # "\x1f" keeps a term from matching across two fields.
+        "_blob": pc.utf8_lower(
+            pc.binary_join_element_wise(
+                code, short_desc, long_desc, pa.scalar("\x1f", code.type)
+            )
+        ),
+    }
 
 df = load_cms_icd10()
+code_index = load_code_index()
+code_keys = load_code_keys()
+search_arrays = load_search_arrays()
+search_blob = search_arrays["_blob"]
 
 # ==========================================
 # PERPLEXITY AI (SONAR-PRO) — NO CITATIONS
 # ==========================================
-def perplexity_chat(system_prompt, user_prompt):
-    api_key = st.secrets.get("PPLX_API_KEY")
-    if not api_key:
-        return None, "Missing PPLX_API_KEY in secrets."
+PPLX_MODEL = "sonar-pro"
+
+# Worker pool for concurrent AI calls (I/O-bound, GIL released). Cached so
+# every session and rerun shares one pool instead of building a new one.
+@st.cache_resource
+def ai_pool():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="ai")
+
+PPLX_URL = "https://api.perplexity.ai/chat/completions"
 
-    headers = {
+# Read once per run, not per call (worker threads never touch st.secrets).
+try:
+    PPLX_API_KEY = (
+        st.secrets.get("PPLX_API_KEY")
+        or st.secrets.get("perplexity", {}).get("API_KEY")
+    )
+except FileNotFoundError:  # no secrets.toml at all
+    PPLX_API_KEY = None
+
+PPLX_TIMEOUT = 30  # seconds
+
+# One keep-alive session for every AI call, shared across reruns and
+# sessions: warm calls skip the TLS handshake and the auth headers are set
+# once. Keyed on the API key, so a rotated secret gets a fresh session.
+# requests is only imported the first time someone asks for an AI summary.
+@st.cache_resource
+def pplx_session(api_key):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util import Retry
+
+    # Transient failures (rate limits, gateway errors) are retried with
+    # exponential backoff before they ever reach the UI.
+    retry = Retry(
+        total=3,
+        backoff_factor=0.7,
+        status_forcelist=[408, 429, 500, 502, 503, 504],
+        allowed_methods=["POST"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    # The pool is sized above ai_pool()'s workers so concurrent calls never queue.
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=retry,
+    ))
+    session.headers.update({
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
-    }
+    })
+    return session
 
-    payload = {
-        "model": "sonar-pro",
+def _pplx_payload(system_prompt, user_prompt):
+    return {
+        "model": PPLX_MODEL,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
@@ -122,9 +255,13 @@ def perplexity_chat(system_prompt, user_prompt):
         "max_tokens": 600
     }
 
+def perplexity_chat(system_prompt, user_prompt):
+    if not PPLX_API_KEY:
+        return None, "Missing PPLX_API_KEY in secrets."
+    payload = _pplx_payload(system_prompt, user_prompt)
+
     try:
-        resp = requests.post("https://api.perplexity.ai/chat/completions",
-                             json=payload, headers=headers, timeout=25)
+        resp = pplx_session(PPLX_API_KEY).post(PPLX_URL, json=payload, timeout=PPLX_TIMEOUT)
 
         if resp.status_code != 200:
             return None, f"AI HTTP {resp.status_code}: {resp.text[:300]}"
@@ -147,19 +284,114 @@ def perplexity_chat(system_prompt, user_prompt):
     except Exception as e:
         return None, f"AI Error: {e}"
 
-# Patient friendly summary
-@st.cache_data(show_spinner=False)
-def get_patient_summary(code, short_desc, long_desc):
-    system = (
-        "Explain medical information in clear, simple language. "
-        "NEVER include citations, numbers in brackets, or sources like [1] [2] (1) etc. "
-        "Do not provide medical advice."
+# Streaming variant (SSE): yields text as it is generated so the UI can
+# show the first tokens right away. Raises RuntimeError on failure.
+def perplexity_chat_stream(system_prompt, user_prompt):
+    if not PPLX_API_KEY:
+        raise RuntimeError("Missing PPLX_API_KEY in secrets.")
+    payload = _pplx_payload(system_prompt, user_prompt)
+    payload["stream"] = True
+
+    try:
+        with pplx_session(PPLX_API_KEY).post(PPLX_URL, json=payload,
+                                             timeout=PPLX_TIMEOUT, stream=True) as resp:
+            if resp.status_code != 200:
+                raise RuntimeError(f"AI HTTP {resp.status_code}: {resp.text[:300]}")
+
+            for line in resp.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    yield content
+    except (OSError, ValueError) as e:  # requests.RequestException is an OSError
+        raise RuntimeError(f"AI Error: {e}") from e
+
+# ==========================================
+# AI RESPONSE CACHE (SQLITE, SHARED ACROSS SESSIONS)
+# ==========================================
+AI_CACHE_PATH = "ai_cache.sqlite3"
+AI_CACHE_TTL = 7 * 86400  # seconds; temperature is 0.2 so answers are stable
+
+def _ai_cache_db():
+    con = sqlite3.connect(AI_CACHE_PATH)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS ai_cache "
+        "(key TEXT PRIMARY KEY, response TEXT, created_at INTEGER)"
     )
-    user = f"""
+    return con
+
+def ai_cache_key(mode, code):
+    # "j45.909", "J45909 " and "J45909" are the same code — share one entry.
+    code = str(code).strip().upper().replace(".", "")
+    return hashlib.sha256(f"{PPLX_MODEL}|{mode}|{code}".encode()).hexdigest()
+
+def check_cache(key):
+    try:
+        with closing(_ai_cache_db()) as con:
+            row = con.execute(
+                "SELECT response FROM ai_cache WHERE key = ? AND created_at >= ?",
+                (key, int(time.time()) - AI_CACHE_TTL),
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+def save_to_cache(key, response):
+    try:
+        with closing(_ai_cache_db()) as con, con:
+            con.execute(
+                "INSERT OR REPLACE INTO ai_cache VALUES (?, ?, ?)",
+                (key, response, int(time.time())),
+            )
+    except sqlite3.Error:
+        pass
+
+def cached_chat(mode, code, system_prompt, user_prompt):
+    # Descriptions are fixed per code, so (mode, code) identifies the answer.
+    key = ai_cache_key(mode, code)
+    cached = check_cache(key)
+    if cached is not None:
+        return cached, None
+
+    text, err = perplexity_chat(system_prompt, user_prompt)
+    if not err and isinstance(text, str) and text.strip():
+        save_to_cache(key, text)
+    return text, err
+
+def cached_chat_stream(mode, code, system_prompt, user_prompt):
+    key = ai_cache_key(mode, code)
+    cached = check_cache(key)
+    if cached is not None:
+        yield cached
+        return
+
+    chunks = []
+    for chunk in perplexity_chat_stream(system_prompt, user_prompt):
+        chunks.append(chunk)
+        yield chunk
+
+    text = "".join(chunks)
+    if text.strip():
+        save_to_cache(key, text)
+
+# ==========================================
+# PROMPTS (STATIC TEXT FIRST FOR PROMPT-PREFIX REUSE)
+# ==========================================
+PAT_SYS = (
+    "Explain medical information in clear, simple language. "
+    "NEVER include citations, numbers in brackets, or sources like [1] [2] (1) etc. "
+    "Do not provide medical advice."
+)
+PAT_TMPL = """
 Explain ICD-10 code {code} in simple language.
 
-Short: {short_desc}
-Long: {long_desc}
+Short: {short}
+Long: {long}
 
 Explain:
 - What this condition means
@@ -167,21 +399,17 @@ Explain:
 - When people usually talk to a doctor
 (No citations, no bracket numbers.)
 """
-    return perplexity_chat(system, user)
-
-# Clinical summary
-@st.cache_data(show_spinner=False)
-def get_clinical_summary(code, short_desc, long_desc):
-    system = (
-        "You explain ICD-10 codes for clinicians. "
-        "Absolutely no citations or bracket numbers. "
-        "Do not provide treatment advice."
-    )
-    user = f"""
+
+CLIN_SYS = (
+    "You explain ICD-10 codes for clinicians. "
+    "Absolutely no citations or bracket numbers. "
+    "Do not provide treatment advice."
+)
+CLIN_TMPL = """
 Provide a clinical explanation for ICD-10 code {code}.
 
-Short: {short_desc}
-Long: {long_desc}
+Short: {short}
+Long: {long}
 
 Include:
 - Clinical meaning
@@ -190,12 +418,43 @@ Include:
 - Documentation context
 (No citations, no sources.)
 """
-    return perplexity_chat(system, user)
+
+# Patient friendly summary. Failures raise RuntimeError rather than
+# returning an error, so st.cache_data never memoizes them.
+@st.cache_data(ttl=AI_CACHE_TTL, max_entries=1024, show_spinner=False)
+def get_patient_summary(code, short_desc, long_desc):
+    user = PAT_TMPL.format(code=code, short=short_desc, long=long_desc)
+    text, err = cached_chat("patient", code, PAT_SYS, user)
+    if err:
+        raise RuntimeError(err)
+    return text
+
+# Clinical summary (streamed)
+def stream_clinical_summary(code, short_desc, long_desc):
+    user = CLIN_TMPL.format(code=code, short=short_desc, long=long_desc)
+    return cached_chat_stream("clinical", code, CLIN_SYS, user)
+
+# Manual eviction, e.g. after a prompt change: drop both cache layers.
+def clear_ai_cache():
+    get_patient_summary.clear()
+    try:
+        with closing(_ai_cache_db()) as con, con:
+            con.execute("DELETE FROM ai_cache")
+    except sqlite3.Error:
+        pass
+
+if st.sidebar.button("🗑️ Clear AI cache"):
+    clear_ai_cache()
+    st.sidebar.success("AI cache cleared.")
 
 # ==========================================
 # PDF BUILDER — STABLE VERSION
 # ==========================================
 def build_pdf(code, short_desc, long_desc, patient_text, clinical_text):
+    # reportlab is only needed once both summaries exist
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
     if not isinstance(patient_text, str) or not patient_text.strip():
         patient_text = "No patient summary available."
     if not isinstance(clinical_text, str) or not clinical_text.strip():
@@ -275,39 +534,79 @@ with search_col:
         placeholder="Example: J45, asthma, diabetes, fracture..."
     )
 
+@st.cache_data(max_entries=256, ttl=600, show_spinner=False)
+def suggestion_positions(q):
+    mask = pc.or_(
+        pc.starts_with(search_arrays["code_lc"], q),
+        pc.match_substring(search_arrays["short_desc_lc"], q),
+    )
+    return np.flatnonzero(mask.to_numpy(zero_copy_only=False))[:8]
+
 suggestions = []
+selected = None
 if query and len(query.strip()) >= 2:
-    q = query.lower()
-    mask = (
-        df["code"].str.lower().str.startswith(q)
-        | df["short_desc"].str.lower().str.contains(q)
-    )
-    suggestions = df[mask].head(8)
+    suggestions = df.take(suggestion_positions(query.lower()))
 
 with sugg_col:
     if len(suggestions) > 0:
         label_list = ["(none)"] + [
-            f"{row.code} — {row.short_desc}" for _, row in suggestions.iterrows()
+            f"{code} — {short_desc}"
+            for code, short_desc in suggestions[["code", "short_desc"]].itertuples(index=False, name=None)
         ]
         choice = st.selectbox("Suggestions", label_list)
         if choice != "(none)":
             query = choice.split(" — ")[0]
+            selected = code_index.get(query)
 
-if not query.strip():
-    st.info("Type at least 1–2 characters to search CMS ICD-10 codes.")
+# One character matches most of the table; don't scan until it's selective.
+if len(query.strip()) < 2:
+    st.info("Type at least 2 characters to search CMS ICD-10 codes.")
     st.stop()
 
 # ==========================================
 # FILTER RESULTS
 # ==========================================
+def search_mask(q):
+    # Every whitespace-separated term must appear in the row's search blob;
+    # later terms only scan rows that matched the earlier ones, so the
+    # longest (usually most selective) term goes first.
+    mask = np.ones(len(df), dtype=bool)
+    for term in sorted(set(q.split()), key=len, reverse=True):
+        if not mask.any():
+            break
+        values = search_blob if mask.all() else search_blob.filter(pa.array(mask))
+        mask[mask] = pc.match_substring(values, term).to_numpy(zero_copy_only=False)
+    return mask
+
+# Looks like an ICD-10 code or code prefix: letter, digit, then letters/digits.
+# CMS stores codes without the dot, so "j45.90" is looked up as "J4590".
+CODE_LIKE = re.compile(r"[a-z]\d[a-z0-9.]*")
+
+def code_prefix_range(prefix):
+    lo, hi = np.searchsorted(code_keys, [prefix, prefix + "\uffff"])
+    return np.arange(lo, hi)
+
+# Cached per query: paging, the AI buttons and other widget reruns reuse
+# the positions instead of rescanning. Only small int arrays are stored.
+@st.cache_data(max_entries=256, ttl=600, show_spinner=False)
+def search_positions(q):
+    if CODE_LIKE.fullmatch(q):
+        # Code prefix: binary search over the sorted codes, no description scan.
+        # Falls through to the text search when no code matches (e.g. "b12").
+        hits = code_prefix_range(q.replace(".", "").upper())
+        if hits.size:
+            return hits
+    return np.flatnonzero(search_mask(q))
+
 q = query.strip().lower()
-mask_res = (
-    df["code"].str.lower().str.contains(q)
-    | df["short_desc"].str.lower().str.contains(q)
-    | df["long_desc"].str.lower().str.contains(q)
-)
-filtered = df[mask_res]
-total = len(filtered)
+
+if selected is not None:
+    # A picked suggestion is an exact code: no scan needed.
+    hits = np.array([selected])
+else:
+    # Positions of matching rows; only the displayed page is materialized.
+    hits = search_positions(q)
+total = hits.size
 
 per_page = st.slider("Results per page", 5, 50, 15, 5)
 max_page = max(1, (total - 1) // per_page + 1)
@@ -315,62 +614,79 @@ page = st.number_input("Page", min_value=1, max_value=max_page, value=1)
 
 start = (page - 1) * per_page
 end = start + per_page
-page_df = filtered.iloc[start:end]
+page_df = df.take(hits[start:end])
 
 st.write(f"Showing {start + 1}–{min(end, total)} of {total} matches.")
 
 # ==========================================
 # RESULTS + AI + PDF
 # ==========================================
-for _, row in page_df.iterrows():
-    code = row["code"]
-    short_desc = row["short_desc"]
-    long_desc = row["long_desc"]
-    nf_excl = row["nf_excl"]
-
-    with st.expander(f"{code} — {short_desc}", expanded=False):
-        st.markdown(
-            f"""
+CARD_TMPL = """
 <div class="code-card">
-    <div><b>{code}</b> — {short_desc}</div>
-    <div style="font-size:14px; margin-top:4px;">{long_desc}</div>
+    <div><b>{code}</b> — {short}</div>
+    <div style="font-size:14px; margin-top:4px;">{long}</div>
     <div style="font-size:12px; opacity:0.7; margin-top:6px;">
-        <b>NF EXCL:</b> {nf_excl if str(nf_excl).strip() else "None"}
+        <b>NF EXCL:</b> {nf}
     </div>
 </div>
-""",
-            unsafe_allow_html=True,
+"""
+
+rows = list(page_df[
+    ["code", "short_desc", "long_desc", "nf_excl", "short_desc_html", "long_desc_html"]
+].itertuples(index=False, name=None))
+
+# Static cards for the whole page go out in a single message.
+st.markdown(
+    "".join(
+        CARD_TMPL.format(
+            code=escape(c),
+            short=sh,
+            long=lh,
+            nf=escape(n) if str(n).strip() else "None",
         )
+        for c, _, _, n, sh, lh in rows
+    ),
+    unsafe_allow_html=True,
+)
 
+# Button clicks inside the panel rerun only this fragment, not the search.
+@st.fragment
+def render_ai_panel(code, short_desc, long_desc):
+    with st.expander(f"{code} — {short_desc}", expanded=False):
         clin_key = f"clin_{code}"
         pat_key = f"pat_{code}"
 
+        generate = st.button("Generate explanations", key=f"btnai_{code}")
+        if generate:
+            # Fetch the patient summary in the background while the
+            # clinical one streams in, so the wait is max(t1, t2).
+            pat_future = ai_pool().submit(get_patient_summary, code, short_desc, long_desc)
+
         colA, colB = st.columns(2)
 
         # --- Clinical summary ---
         with colA:
             st.subheader("Clinical explanation")
-            if st.button("Generate clinical summary", key=f"btnclin_{code}"):
-                with st.spinner("Querying AI…"):
-                    text, err = get_clinical_summary(code, short_desc, long_desc)
-                if err:
-                    st.error(err)
+            if generate:
+                try:
+                    text = st.write_stream(stream_clinical_summary(code, short_desc, long_desc))
+                except RuntimeError as e:
+                    st.error(str(e))
                 else:
-                    st.session_state[clin_key] = text
-
-            if clin_key in st.session_state:
+                    if isinstance(text, str) and text.strip():
+                        st.session_state[clin_key] = text
+            elif clin_key in st.session_state:
                 st.write(st.session_state[clin_key])
 
         # --- Patient summary ---
         with colB:
             st.subheader("Patient explanation")
-            if st.button("Generate patient summary", key=f"btnpat_{code}"):
-                with st.spinner("Querying AI…"):
-                    text, err = get_patient_summary(code, short_desc, long_desc)
-                if err:
-                    st.error(err)
-                else:
-                    st.session_state[pat_key] = text
+            if generate:
+                try:
+                    with st.spinner("Querying AI…"):
+                        st.session_state[pat_key] = pat_future.result()
+                except RuntimeError as e:
+                    st.error(str(e))
 
             if pat_key in st.session_state:
                 st.write(st.session_state[pat_key])
@@ -389,4 +705,8 @@ for _, row in page_df.iterrows():
                 mime="application/pdf"
             )
         else:
-            st.caption("Generate both summaries to download PDF.")
+            st.caption("Generate explanations to download PDF.")
+
+
+for code, short_desc, long_desc, *_ in rows:
+    render_ai_panel(code, short_desc, long_desc)